@@ -1,12 +1,218 @@
+import base64
+import collections
+import functools
 import requests
 import json
 import ntpath
+import os
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from servicenow_api_client.exceptions import *
 
+# orjson parses the large table responses a few times faster than the
+# stdlib codec, but remains optional
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def _parse(response):
+    """
+    Decode the JSON body of a response with the fastest available codec
+
+    :param response: response object returned by the session
+
+    Output : returns the decoded JSON body
+    """
+
+    return _json_loads(response.content)
+
+
+def _require_str(name, value):
+    """
+    Raise InvalidFormat unless value is a string
+
+    :param name: label used in the error message (string)
+    :param value: value to validate
+
+    Output : returns the validated value
+    """
+
+    if not isinstance(value, str):
+        raise InvalidFormat(name + ' format incorrect. String expected.')
+    return value
+
+
+def _require_dict(name, value):
+    """
+    Raise InvalidFormat unless value is a dictionary
+
+    :param name: label used in the error message (string)
+    :param value: value to validate
+
+    Output : returns the validated value
+    """
+
+    if not isinstance(value, dict):
+        raise InvalidFormat(name + ' format incorrect. Dictionary expected.')
+    return value
+
+
+@functools.lru_cache(maxsize=128)
+def _define_table(table, custom):
+    """
+    Resolve the URL path of a table, cached per (table, custom) pair
+
+    :param table: name of table (string)
+    :param custom: True when the table path is used verbatim instead of
+                   the default /api/now/table/table_name (boolean)
+
+    Output : returns the table path
+    """
+
+    if custom:
+        return table
+    else:
+        return f'/api/now/table/{table}'
+
+
+# Constant lookup tables below are wrapped in MappingProxyType so a
+# caller cannot mutate them by accident
+
+# ServiceNow operators and symbols dictionary
+_OPERATORS = types.MappingProxyType({
+    'is': '=',
+    'is not': '!=',
+    'is one of': 'IN',
+    'starts with': 'STARTSWITH',
+    'ends with': 'ENDSWITH',
+    'contains': 'LIKE',
+    'does not contain': 'NOT LIKE',
+    'less than or is': '<=',
+    'greater than or is': '>=',
+    'same as': 'SAMEAS',
+    'is empty': 'ISEMPTY',
+    'is not empty': 'ISNOTEMPTY',
+    'is anything': 'ANYTHING',
+    'is empty string': 'EMPTYSTRING'
+})
+
+# Operator names reused in error messages
+_OPERATOR_NAMES = tuple(_OPERATORS)
+
+# Incident states and value
+_INC_STATE = types.MappingProxyType({
+    'new': '1',
+    'in progress': '2',
+    'on hold': '3',
+    'resolved': '6',
+    'closed': '7',
+    'canceled': '8'
+})
+
+# Close Notes comments for incident state
+_INC_NOTES = types.MappingProxyType({
+    'new': '',
+    'in progress': '',
+    'on hold': '',
+    'resolved': 'Incident resolved',
+    'closed': 'Incident closed',
+    'canceled': 'Incident canceled'
+})
+
+# Close code selected for incident state
+_INC_CLOSE_CODE = types.MappingProxyType({
+    'new': '',
+    'in progress': '',
+    'on hold': '',
+    'resolved': 'Solved (Permanently)',
+    'closed': 'Solved (Permanently)',
+    'canceled': 'Closed/Resolved by Caller'
+})
+
+# Problem states and value
+_PRB_STATE = types.MappingProxyType({
+    'open': '1',
+    'known error': '2',
+    'pending change': '3',
+    'closed/resolved': '4'
+})
+
+# Work Notes comments for problem state
+_PRB_WORK_NOTES = types.MappingProxyType({
+    'open': 'Problem in open state',
+    'known error': 'Problem has known error',
+    'pending change': 'Problem is pending change',
+    'closed/resolved': 'Problem resolved'
+})
+
+# Close Notes comments for problem state
+_PRB_CLOSE_NOTES = types.MappingProxyType({
+    'open': '',
+    'known error': '',
+    'pending change': '',
+    'closed/resolved': 'Problem closed/resolved'
+})
+
+
+# Upper bound on cached entries per client-side cache; the oldest
+# entry is evicted first once a cache is full
+_CACHE_MAX_ENTRIES = 256
+
+
+def _bounded_put(cache, key, value):
+    # Dictionaries iterate in insertion order, so the first key is the
+    # least recently used entry
+    while len(cache) >= _CACHE_MAX_ENTRIES:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+def _normalize_clause(line):
+    # List values (the natural shape for "is one of") are joined into the
+    # comma-separated form the IN operator expects; this also keeps every
+    # clause hashable for the _compile_query cache
+    return tuple(','.join(map(str, part)) if isinstance(part, (list, tuple)) else part for part in line)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_query(clauses):
+    """
+    Compile a tuple of (field, operator, value) clauses into a sysparm_query
+
+    The operator table is constant, so repeated searches with the same
+    clauses reuse the compiled query instead of rebuilding it.
+
+    :param clauses: clauses as tuples of field, operator and optional value
+
+    Output : returns the sysparm_query string
+    """
+
+    fragments = []
+    for line in clauses:
+        field = line[0]
+        operator = line[1]
+        # The value may be omitted for operators like "is empty"
+        value = line[2] if len(line) > 2 else ''
+        try:
+            fragments.append(f'{field}{_OPERATORS[operator.lower()]}{value}')
+        except KeyError:
+            raise InvalidValue(
+                'Operator value invalid. Choose one of the following:\n' + str(_OPERATOR_NAMES))
+
+    return '^'.join(fragments)
+
 
 class ServiceNowClient:
 
-    def __init__(self, instance, user, password, empty_error=True):
+    def __init__(self, instance, user, password, empty_error=True, concurrency=8, http2=False,
+                 cache_ttl=60):
         """
         Initialize ServiceNow instance
 
@@ -15,15 +221,95 @@ class ServiceNowClient:
         :param user: username (string)
         :param password: password (string)
         :param empty_error: raise exception if result is empty
+        :param concurrency: number of parallel workers for bulk operations, default is 8
+        :param http2: multiplex requests over HTTP/2, requires the optional
+                      httpx package with h2 installed (boolean)
+        :param cache_ttl: seconds a search result may be served from the
+                          cache, 0 disables caching, default is 60
 
         Output : none
         """
 
         self.username = user
         self.password = password
-        self.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        # The Basic auth token is encoded once here instead of letting the
+        # HTTP layer re-encode user:password on every single request
+        token = base64.b64encode((user + ':' + password).encode()).decode()
+        # Ask for gzip so the large JSON payloads travel compressed;
+        # requests decompresses them transparently
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json',
+                        'Accept-Encoding': 'gzip, deflate',
+                        'Connection': 'keep-alive',
+                        'Authorization': 'Basic ' + token
+                        }
         self.instance = 'https://' + instance + '.service-now.com'
         self.empty_error = empty_error
+        self.concurrency = concurrency
+        self._executor = None
+        self._email_cache = {}
+        self.cache_ttl = cache_ttl
+        self._get_cache = {}
+
+        # With http2=True the N-per-item fan-outs share one multiplexed
+        # connection instead of a pool of HTTP/1.1 sockets
+        self.http2 = False
+        if http2:
+            try:
+                import httpx
+                self.session = httpx.Client(http2=True,
+                                            headers=self.headers,
+                                            limits=httpx.Limits(max_connections=10,
+                                                                max_keepalive_connections=10)
+                                            )
+                # The keep-alive header only means something to the requests
+                # session; httpx merges its own keep-alive default in, so it
+                # has to be removed from the built client
+                self.session.headers.pop('Connection', None)
+                self.http2 = True
+            except ImportError:
+                # httpx/h2 not installed, fall back to the requests session
+                pass
+
+        if not self.http2:
+            # Single session shared by every call, so the TCP+TLS connection
+            # is kept alive and pooled instead of re-established per request
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            # 429 is retried with backoff so a ServiceNow rate limit slows a
+            # bulk run down instead of failing it; the pool always has at
+            # least one socket per worker
+            retry = Retry(total=5,
+                          backoff_factor=1.0,
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=frozenset(['GET', 'POST', 'PATCH', 'PUT', 'DELETE']),
+                          respect_retry_after_header=True
+                          )
+            adapter = HTTPAdapter(pool_connections=10,
+                                  pool_maxsize=max(20, concurrency),
+                                  max_retries=retry
+                                  )
+            self.session.mount('https://', adapter)
+
+    def close(self):
+        """
+        Close the underlying HTTP session and release pooled connections
+
+        :param self: self object
+
+        Output : none
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def create(self, table, data, custom, max_retries=3, timeout=10):
         """
@@ -34,34 +320,31 @@ class ServiceNowClient:
         :param data: fields and value to be set for record (dictionary)
         :param custom: if you are using a custom table and you don't want
                        use the default url /api/now/table/table_name (boolean)
-        :param max_retries: max retries, default is 3
+        :param max_retries: kept for backward compatibility, retries are configured on the shared session
         :param timeout: set timeout interval, default is 10
         Output : returns all fields and details of new record
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(data, 'Data', dict, 'Dictionary')
+        _require_str('Table', table)
+        _require_dict('Data', data)
 
         # Set the request parameters
-        self.url = self.instance + str(self.__define_table(table, custom))
-
-        sess = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
-        sess.mount(self.instance, adapter=adapter)
-        self.response = sess.post(url=self.url,
-                                  auth=(self.username, self.password),
-                                  headers=self.headers,
-                                  data=json.dumps(data),
-                                  timeout=timeout
-                                  )
+        url = self.instance + _define_table(table, custom)
+
+        response = self.session.post(url=url,
+                                     json=data,
+                                     timeout=timeout
+                                     )
 
-        if self.response.status_code > 299:
+        if response.status_code > 299:
             raise ResponseError(
-                'Error code = ' + str(self.response.status_code) + ' , Error details = ' + str(self.response.json()))
+                'Error code = ' + str(response.status_code) + ' , Error details = ' + str(_parse(response)))
+
+        self._cache_invalidate(table)
 
         # Return the ticket details
-        return self.response.json()
+        return _parse(response)
 
     def update(self, table, search_list, data, custom, max_retries=3, timeout=10):
         """
@@ -73,54 +356,141 @@ class ServiceNowClient:
         :param data: field and value to be updated (dictionary)
         :param custom: if you are using a custom table and you don't want
                        use the default url /api/now/table/table_name (boolean)
-        :param max_retries: max retries, default is 3
+        :param max_retries: kept for backward compatibility, retries are configured on the shared session
         :param timeout: set timeout interval, default is 10
 
         Output : returns dictionary containing number and status of request as true or false or error
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(data, 'Data', dict, 'Dictionary')
+        _require_str('Table', table)
+        _require_dict('Data', data)
+
+        # Fast path when the caller already knows the sys_id
+        sys_id = self.__sys_id_shortcut(search_list)
+        if sys_id is not None:
+            return self.update_by_id(table, sys_id, data, custom, timeout=timeout)
+
+        # One PATCH sub-request per matching record, executed server-side
+        # by the Batch API; the search is drained completely first, because
+        # writing while the offset-based paging is still running would
+        # shift later pages and skip still-matching records
+        body = base64.b64encode(json.dumps(data).encode()).decode()
+        path = _define_table(table, custom)
+
+        def _sub_request(sys_id):
+            return {'id': sys_id,
+                    'method': 'PATCH',
+                    'url': path + '/' + sys_id,
+                    'headers': [{'name': 'Content-Type', 'value': 'application/json'},
+                                {'name': 'Accept', 'value': 'application/json'}],
+                    'body': body
+                    }
+
+        sys_ids = [item['sys_id'] for item in self.iter_search(table, search_list, custom, 'sys_id')]
 
-        # Calling search method to search for matching incidents
-        incident_list = self.search(table, search_list, custom, 'sys_id')
-        #
         # Terminate operation if no incidents are found
-        if not incident_list:
+        if not sys_ids:
             if self.empty_error:
                 raise EmptyResult('No record found')
             else:
                 return False
 
+        executor = self._get_executor()
+        futures = [executor.submit(self._batch, [_sub_request(sys_id) for sys_id in sys_ids[start:start + 100]],
+                                   timeout)
+                   for start in range(0, len(sys_ids), 100)]
+
         # Output dictionary
         result = {}
 
-        for item in incident_list:
-
-            # Set the request parameters
-            self.url = self.instance + str(self.__define_table(table, custom)) + '/' + str(item['sys_id'])
-            sess = requests.Session()
-            adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
-            sess.mount(self.instance, adapter=adapter)
-            self.response = sess.patch(url=self.url,
-                                       auth=(self.username, self.password),
-                                       headers=self.headers,
-                                       data=json.dumps(data),
-                                       timeout=timeout
-                                       )
-
-            if self.response.status_code > 299:
-                raise ResponseError(
-                    'Error code = ' + str(self.response.status_code) + ' , Error details = ' + str(
-                        self.response.json()['error']))
-            else:
-                result[str(item['sys_id'])] = 'true'
+        # The cache is invalidated even when a batch fails part-way, so a
+        # partially applied update never serves stale pages for the TTL
+        try:
+            for future in as_completed(futures):
+                for serviced in future.result():
+                    if serviced['status_code'] > 299:
+                        raise ResponseError(
+                            'Error code = ' + str(serviced['status_code']) + ' , Error details = ' + str(
+                                self.__decode_batch_body(serviced)))
+                    else:
+                        result[serviced['id']] = 'true'
+        finally:
+            self._cache_invalidate(table)
 
         # Return result
         return result
 
-    def search(self, table, search_list, custom, fields='', max_retries=3, timeout=10):
+    def update_by_id(self, table, sys_id, data, custom=False, timeout=10):
+        """
+        Update a record directly by its sys_id, skipping the search round trip
+
+        :param self: self object
+        :param table: name of table (string)
+        :param sys_id: sysId of the record to update (string)
+        :param data: field and value to be updated (dictionary)
+        :param custom: True if you are using a custom table and you don't want
+                       use the default url /api/now/table/table_name (boolean)
+        :param timeout: set timeout interval, default is 10
+
+        Output : returns dictionary containing sys_id and status of request as true
+        """
+
+        # Validation
+        _require_str('Table', table)
+        _require_str('Sys_id', sys_id)
+        _require_dict('Data', data)
+
+        url = self.instance + _define_table(table, custom) + '/' + sys_id
+        response = self.session.patch(url=url, json=data, timeout=timeout)
+
+        if response.status_code > 299:
+            raise ResponseError(
+                'Error code = ' + str(response.status_code) + ' , Error details = ' + str(
+                    _parse(response)['error']))
+
+        self._cache_invalidate(table)
+
+        return {sys_id: 'true'}
+
+    def delete_by_id(self, table, sys_id, custom=False):
+        """
+        Delete a record directly by its sys_id, skipping the search round trip
+
+        :param self: self object
+        :param table: name of table (string)
+        :param sys_id: sysId of the record to delete (string)
+        :param custom: True if you are using a custom table and you don't want
+                       use the default url /api/now/table/table_name (boolean)
+
+        Output : returns dictionary containing sys_id and status of request as true or error
+        """
+
+        # Validation
+        _require_str('Table', table)
+        _require_str('Sys_id', sys_id)
+
+        url = self.instance + _define_table(table, custom) + '/' + sys_id
+        response = self.session.delete(url=url)
+
+        if response.status_code > 299:
+            return {sys_id: 'Error Code ' + str(response.status_code) + ', ' + str(_parse(response)['error'])}
+
+        self._cache_invalidate(table)
+
+        return {sys_id: 'true'}
+
+    @staticmethod
+    def __sys_id_shortcut(search_list):
+        # A bare sys_id string or a {'sys_id': ...} dictionary selects the
+        # record directly without a search
+        if isinstance(search_list, str):
+            return search_list
+        if isinstance(search_list, dict):
+            return search_list.get('sys_id')
+        return None
+
+    def search(self, table, search_list, custom, fields='', max_retries=3, timeout=10, limit=10000):
         """
         Method to retrieve an incident based on search parameters
 
@@ -130,107 +500,127 @@ class ServiceNowClient:
         :param fields: comma separated response fields (string)
         :param custom: True if you are using a custom table and you don't want
                        use the default url /api/now/table/table_name (boolean)
-        :param max_retries: max retries, default is 3
+        :param max_retries: kept for backward compatibility, retries are configured on the shared session
         :param timeout: set timeout interval, default is 10
+        :param limit: maximum number of records to retrieve, default is 10000
 
         Output : returns response fields of each matching records
         """
 
-        self.url = (self.instance
-                    + str(self.__define_table(table, custom)) + '?sysparm_limit=50&sysparm_query=sysparm_query='
-                    )
-
-        # ServiceNow operators and symbols dictionary
-        operators = {
-            'is': '=',
-            'is not': '!=',
-            'is one of': 'IN',
-            'starts with': 'STARTSWITH',
-            'ends with': 'ENDSWITH',
-            'contains': 'LIKE',
-            'does not contain': 'NOT LIKE',
-            'less than or is': '<=',
-            'greater than or is': '>=',
-            'same as': 'SAMEAS',
-            'is empty': 'ISEMPTY',
-            'is not empty': 'ISNOTEMPTY',
-            'is anything': 'ANYTHING',
-            'is empty string': 'EMPTYSTRING'
-        }
-
-        # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(fields, 'Fields', str, 'String')
-
-        # Validating, parsing searchList elements to form query part of url
-        for line in search_list:
-            # Nested list
-            if isinstance(line, list):
-                field = line[0]
-                operator = line[1]
-                try:
-                    value = line[2]
-                except IndexError:
-                    # Each list must contain 3 elements
-                    line.insert(2, '')
-                    value = line[2]
-                try:
-                    self.url = self.url + '^%s%s%s' % (field, operators[operator.lower()], value)
-                except KeyError:
-                    raise InvalidValue(
-                        'Operator value invalid. Choose one of the following:\n' + str(tuple(x for x in operators)))
+        incident_list = []
+        for item in self.iter_search(table, search_list, custom, fields, timeout=timeout):
+            incident_list.append(item)
+            if len(incident_list) >= limit:
+                break
 
+        if not incident_list:
+            if self.empty_error:
+                raise EmptyResult('No record found')
             else:
-                # Setting flag incase of a simple list
-                single_list = 'true'
-
-        try:
-            # Simple list
-            if (single_list == 'true') and (isinstance(search_list, list)):
-                try:
-                    self.url = self.url + '^%s%s' % (search_list[0], operators[search_list[1].lower()])
-                except KeyError:
-                    raise InvalidValue(
-                        'Operator value invalid. Choose one of the following:\n' + str(tuple(x for x in operators)))
-
-                try:
-                    self.url = self.url + '%s' % (search_list[2])
-                except IndexError:
-                    # Each list must contain 3 elements
-                    search_list.insert(2, '')
-                    self.url = self.url + '%s' % (search_list[2])
+                print('\n\n**No record found**')
+                return False
 
-            else:
-                raise InvalidFormat('"searchList" format incorrect. Simple or nested list expected')
+        # Return the matching records (list of dictionaries)
+        return incident_list
 
-        except UnboundLocalError:
-            print('')
+    def iter_search(self, table, search_list, custom, fields='', timeout=10, page=1000):
+        """
+        Generator that retrieves matching records one page at a time
 
-        self.url = self.url + '&sysparm_fields=' + str(fields)
+        :param self: self object
+        :param table: name of table (string)
+        :param search_list: comma separated field, operator and value to retrieve matching incidents (simple or nested lists)
+        :param fields: comma separated response fields (string)
+        :param custom: True if you are using a custom table and you don't want
+                       use the default url /api/now/table/table_name (boolean)
+        :param timeout: set timeout interval, default is 10
+        :param page: number of records fetched per request, default is 1000
 
-        sess = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
-        sess.mount(self.instance, adapter=adapter)
-        self.response = sess.get(url=self.url,
-                                 auth=(self.username, self.password),
-                                 headers=self.headers,
-                                 timeout=timeout
-                                 )
+        Output : yields response fields of each matching record
+        """
 
-        # Check for HTTP codes other than 200
-        if self.response.status_code > 299:
-            raise ResponseError(
-                'Error code = ' + str(self.response.status_code) + ' , Error details = ' + str(self.response.json()))
+        # Validation
+        _require_str('Table', table)
+        _require_str('Fields', fields)
+
+        # Validating, parsing searchList elements to form the query
+        if isinstance(search_list, list) and search_list and all(isinstance(line, list) for line in search_list):
+            # Nested list of [field, operator, value] clauses
+            clauses = tuple(_normalize_clause(line) for line in search_list)
+        elif isinstance(search_list, list) and len(search_list) >= 2 and isinstance(search_list[0], str):
+            # Simple list is a single clause
+            clauses = (_normalize_clause(search_list),)
         else:
-            if not self.response.json()['result']:
-                if self.empty_error:
-                    raise EmptyResult('No record found')
-                else:
-                    print('\n\n**No record found**')
-                    return False
+            raise InvalidFormat('"searchList" format incorrect. Simple or nested list expected')
 
-        # Return the JSON response (dictionary type)
-        return self.response.json()['result']
+        # Let requests encode the query string, so special characters in
+        # field values survive the trip
+        url = self.instance + _define_table(table, custom)
+        try:
+            query = _compile_query(clauses)
+        except TypeError:
+            # An unhashable clause value (e.g. a dictionary) cannot form a query
+            raise InvalidFormat('"searchList" format incorrect. Field, operator and value expected per clause')
+
+        # Page through the result set with sysparm_offset; a short page
+        # means the server has no more matching records
+        offset = 0
+        while True:
+            # Reference fields come back as plain values instead of link
+            # objects, which shrinks the payload considerably
+            params = {'sysparm_limit': page,
+                      'sysparm_offset': offset,
+                      'sysparm_query': query,
+                      'sysparm_fields': str(fields),
+                      'sysparm_exclude_reference_link': 'true',
+                      'sysparm_suppress_pagination_header': 'true'
+                      }
+
+            # Identical searches within the TTL are served from the cache
+            cache_key = (table, custom, query, str(fields), page, offset)
+            records = self._cache_get(cache_key)
+
+            if records is None:
+                response = self.session.get(url=url, params=params, timeout=timeout)
+
+                # Check for HTTP codes other than 200
+                if response.status_code > 299:
+                    raise ResponseError(
+                        'Error code = ' + str(response.status_code) + ' , Error details = ' + str(_parse(response)))
+
+                records = _parse(response)['result']
+                self._cache_put(cache_key, records)
+
+            yield from records
+
+            if len(records) < page:
+                return
+
+            offset += page
+
+    def _cache_get(self, key):
+        # Return the cached value for key if it is still within the TTL;
+        # expired entries are dropped on access and hits are re-inserted
+        # so eviction discards the least recently used page first
+        if self.cache_ttl <= 0:
+            return None
+        entry = self._get_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.cache_ttl:
+            del self._get_cache[key]
+            return None
+        self._get_cache[key] = self._get_cache.pop(key)
+        return entry[1]
+
+    def _cache_put(self, key, value):
+        if self.cache_ttl > 0:
+            _bounded_put(self._get_cache, key, (time.monotonic(), value))
+
+    def _cache_invalidate(self, table):
+        # Writes make every cached search against the table stale
+        for key in [key for key in self._get_cache if key[0] == table]:
+            del self._get_cache[key]
 
     def delete(self, table, search_list, custom):
         """
@@ -245,36 +635,51 @@ class ServiceNowClient:
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
+        _require_str('Table', table)
 
-        # Calling search method to search for matching incidents
-        incident_list = self.search(table, search_list, custom, 'sys_id')
+        # Fast path when the caller already knows the sys_id
+        sys_id = self.__sys_id_shortcut(search_list)
+        if sys_id is not None:
+            return self.delete_by_id(table, sys_id, custom)
+
+        # One DELETE sub-request per matching record, executed server-side
+        # by the Batch API; the search is drained completely first, because
+        # deleting while the offset-based paging is still running would
+        # shift later pages and skip still-matching records
+        path = _define_table(table, custom)
+
+        def _sub_request(sys_id):
+            return {'id': sys_id,
+                    'method': 'DELETE',
+                    'url': path + '/' + sys_id,
+                    'headers': [{'name': 'Accept', 'value': 'application/json'}]
+                    }
+
+        sys_ids = [item['sys_id'] for item in self.iter_search(table, search_list, custom, 'sys_id')]
 
         # Terminate operation if no incidents are found
-        if not incident_list:
+        if not sys_ids:
             if self.empty_error:
                 raise EmptyResult('No record found')
             else:
                 return False
 
+        executor = self._get_executor()
+        futures = [executor.submit(self._batch, [_sub_request(sys_id) for sys_id in sys_ids[start:start + 100]])
+                   for start in range(0, len(sys_ids), 100)]
+
         # Output dictionary
         result = {}
 
-        for item in incident_list:
-
-            # Set the request parameters
-            self.url = self.instance + str(self.__define_table(table, custom)) + '/' + str(item['sys_id'])
-
-            self.response = requests.delete(url=self.url,
-                                            auth=(self.username, self.password),
-                                            headers=self.headers,
-                                            )
+        for future in as_completed(futures):
+            for serviced in future.result():
+                if serviced['status_code'] > 299:
+                    result[serviced['id']] = 'Error Code ' + str(serviced['status_code']) + ', ' + str(
+                        self.__decode_batch_body(serviced))
+                else:
+                    result[serviced['id']] = 'true'
 
-            if self.response.status_code > 299:
-                result[str(item['sys_id'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                    self.response.json()['error'])
-            else:
-                result[str(item['sys_id'])] = 'true'
+        self._cache_invalidate(table)
 
         # Return result
         return result
@@ -295,8 +700,8 @@ class ServiceNowClient:
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(state, 'State', str, 'String')
+        _require_str('Table', table)
+        _require_str('State', state)
 
         table = table.lower()
         # Calling search method to search for matching incidents
@@ -309,103 +714,83 @@ class ServiceNowClient:
             else:
                 return False
 
-        # Incident states and value
-        inc_state = {
-            'new': '1',
-            'in progress': '2',
-            'on hold': '3',
-            'resolved': '6',
-            'closed': '7',
-            'canceled': '8'
-        }
-
-        # Close Notes comments for incident state
-        inc_notes = {
-            'new': '',
-            'in progress': '',
-            'on hold': '',
-            'resolved': 'Incident resolved',
-            'closed': 'Incident closed',
-            'canceled': 'Incident canceled'
-        }
-
-        # Close code selected for incident state
-        inc_close_code = {
-            'new': '',
-            'in progress': '',
-            'on hold': '',
-            'resolved': 'Solved (Permanently)',
-            'closed': 'Solved (Permanently)',
-            'canceled': 'Closed/Resolved by Caller'
-        }
-
-        # Incident states and value
-        prb_state = {
-            'open': '1',
-            'known error': '2',
-            'pending change': '3',
-            'closed/resolved': '4'
-        }
-
-        # Work Notes comments for incident state
-        prb_work_notes = {
-            'open': 'Problem in open state',
-            'known error': 'Problem has known error',
-            'pending change': 'Problem is pending change',
-            'closed/resolved': 'Problem resolved'
-        }
-
-        # Close Notes comments for incident state
-        prb_close_notes = {
-            'open': '',
-            'known error': '',
-            'pending change': '',
-            'closed/resolved': 'Problem closed/resolved'
-        }
+        # The state is loop invariant, so the payload and URL prefix are
+        # computed once instead of per item
+        state_key = state.lower()
+        if table == 'problem':
+            path = '/api/now/table/problem'
+            try:
+                data = {'close_notes': _PRB_CLOSE_NOTES[state_key],
+                        'work_notes': _PRB_WORK_NOTES[state_key],
+                        'state': _PRB_STATE[state_key]
+                        }
+            except KeyError:
+                raise InvalidValue(
+                    '"state" invalid. Choose one of the following:\n' + str(tuple(_PRB_STATE)))
+        else:
+            path = _define_table(table, custom)
+            try:
+                data = {'close_code': _INC_CLOSE_CODE[state_key],
+                        'close_notes': _INC_NOTES[state_key],
+                        'state': _INC_STATE[state_key]
+                        }
+            except KeyError:
+                raise InvalidValue(
+                    '"state" invalid. Choose one of the following:\n' + str(tuple(_INC_STATE)))
+
+        # The payload is identical for every record, only the sys_id in the
+        # URL differs, so all PUTs collapse into one Batch API round trip
+        body = base64.b64encode(json.dumps(data).encode()).decode()
+        rest_requests = [{'id': item['number'],
+                          'method': 'PUT',
+                          'url': path + '/' + item['sys_id'],
+                          'headers': [{'name': 'Content-Type', 'value': 'application/json'},
+                                      {'name': 'Accept', 'value': 'application/json'}],
+                          'body': body
+                          } for item in incident_list]
 
         # Output dictionary
         result = {}
 
-        # Storing sys_id of each incident found
-        for item in incident_list:
-            if table == 'problem':
-                self.url = self.instance + '/api/now/table/problem/' + item['sys_id']
-                try:
-                    self.data = ('{\"close_notes\":\"' + prb_close_notes[state.lower()]
-                                 + '\",\"work_notes\":\"' + prb_work_notes[state.lower()]
-                                 + '\",\"state\":\"' + prb_state[state.lower()]
-                                 + '\"}'
-                                 )
-                except KeyError:
-                    raise InvalidValue(
-                        '"state" invalid. Choose one of the following:\n' + str(tuple(x for x in prb_state)))
+        for serviced in self._batch(rest_requests):
+            if serviced['status_code'] > 299:
+                result[serviced['id']] = 'Error Code ' + str(serviced['status_code']) + ', ' + str(
+                    self.__decode_batch_body(serviced))
             else:
-                try:
-                    self.url = self.instance + str(self.__define_table(table, custom)) + '/' + item['sys_id']
-                    self.data = ('{\"close_code\":\"' + inc_close_code[state.lower()]
-                                 + '\",\"close_notes\":\"' + inc_notes[state.lower()]
-                                 + '\",\"state\":\"' + inc_state[state.lower()]
-                                 + '\"}'
-                                 )
-                except KeyError:
-                    raise InvalidValue(
-                        '"state" invalid. Choose one of the following:\n' + str(tuple(x for x in inc_state)))
-
-            self.response = requests.put(url=self.url,
-                                         auth=(self.username, self.password),
-                                         headers=self.headers,
-                                         data=self.data
-                                         )
+                result[serviced['id']] = 'true'
 
-            if self.response.status_code > 299:
-                result[str(item['number'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                    self.response.json()['error'])
-            else:
-                result[str(item['number'])] = 'true'
+        self._cache_invalidate(table)
 
         # Return success
         return result
 
+    def _list_attachments(self, incident_list):
+        # One attachment query covers many incidents (table_sys_idIN...),
+        # grouped client-side, instead of one list GET per incident. The
+        # IN list is chunked so the query string stays well below URL and
+        # header size limits even when thousands of records match
+        url = self.instance + '/api/now/attachment'
+        sys_ids = [item['sys_id'] for item in incident_list]
+
+        by_sys_id = collections.defaultdict(list)
+        for start in range(0, len(sys_ids), 200):
+            params = {'sysparm_limit': 10000,
+                      'sysparm_query': 'active=true^table_sys_idIN' + ','.join(sys_ids[start:start + 200]),
+                      'sysparm_fields': 'sys_id,file_name,table_sys_id,download_link'
+                      }
+
+            response = self.session.get(url=url, params=params)
+
+            # Check for HTTP codes other than 200
+            if response.status_code > 299:
+                raise ResponseError(
+                    'Error code = ' + str(response.status_code) + ' , Error details = ' + str(
+                        _parse(response)['error']))
+
+            for attachment in _parse(response)['result']:
+                by_sys_id[attachment['table_sys_id']].append(attachment)
+        return by_sys_id
+
     def get_file(self, table, search_list, custom, type=''):
         """
         Retrieve Attachment details pertaining to an incident and get the web link for download
@@ -420,8 +805,8 @@ class ServiceNowClient:
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(type, 'Type', str, 'String')
+        _require_str('Table', table)
+        _require_str('Type', type)
 
         # Calling search method to search for matching incidents
         incident_list = self.search(table, search_list, custom, 'number,sys_id')
@@ -433,55 +818,55 @@ class ServiceNowClient:
             else:
                 return False
 
-        file_type_found_all = False
-
-        # Output dictionary
-        result = {}
-
-        # Checking for incidents for attachments
-        for item in incident_list:
-
-            # URL to fetch attachment
-            self.url = (self.instance
-                        + '/api/now/attachment?sysparm_limit=50&sysparm_query=sysparm_query=active=true^table_sys_id='
-                        + item['sys_id'])
+        # All attachment listings collapse into one round trip; only the
+        # downloads fan out
+        attachments_by_sys_id = self._list_attachments(incident_list)
 
-            self.response = requests.get(url=self.url,
-                                         auth=(self.username, self.password),
-                                         headers=self.headers,
-                                         )
-
-            # Check for HTTP codes other than 200
-            if self.response.status_code > 299:
-                result[str(item['number'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                    self.response.json()['error'])
-            else:
-                result[str(item['number'])] = 'true'
-
-            # Decode the JSON response
-            attachment_data = self.response.json()
+        def _do(item):
+            attachments = attachments_by_sys_id.get(item['sys_id'])
 
             # Terminate operation if no incidents are found
-            if not attachment_data['result']:
-                result[str(item['number'])] = 'false'
-                continue
-            else:
-                result[str(item['number'])] = 'true'
+            if not attachments:
+                return item['number'], 'false', False
 
             # Download the specified types of file from the web location received in JSON response
             file_type_found = False
-            for item_attach in attachment_data['result']:
+            for item_attach in attachments:
                 if item_attach['file_name'].endswith(type):
                     file_type_found = True
-                    file_type_found_all = True
-                    r = requests.get(item_attach['download_link'], auth=(self.username, self.password))
 
-                    # Files downloaded under Python directory
-                    with open(item_attach['file_name'], 'wb') as code:
-                        code.write(r.content)
+                    # Each worker streams to its own temporary name and
+                    # renames atomically, so parallel downloads of
+                    # attachments that share a file name cannot interleave
+                    # chunks; the last rename wins with an intact file
+                    file_name = item_attach['file_name']
+                    tmp_name = file_name + '.' + uuid.uuid4().hex + '.part'
+
+                    # Stream straight to disk so memory stays bounded by the
+                    # chunk size instead of the attachment size
+                    if self.http2:
+                        with self.session.stream('GET', item_attach['download_link'], timeout=60) as r:
+                            # Files downloaded under Python directory
+                            with open(tmp_name, 'wb') as code:
+                                for chunk in r.iter_bytes(chunk_size=1 << 20):
+                                    code.write(chunk)
+                    else:
+                        with self.session.get(item_attach['download_link'], stream=True, timeout=60) as r:
+                            # Files downloaded under Python directory
+                            with open(tmp_name, 'wb') as code:
+                                for chunk in r.iter_content(chunk_size=1 << 20):
+                                    code.write(chunk)
+
+                    os.replace(tmp_name, file_name)
+
+            return item['number'], 'true', file_type_found
 
-            if file_type_found:
-                result[str(item['number'])] = 'true'
+        # Output dictionary
+        result = {}
+        file_type_found_all = False
+        for number, value, found in self._parallel_map(_do, incident_list):
+            result[number] = value
+            file_type_found_all = file_type_found_all or found
 
         if file_type_found_all:
             return result
@@ -506,8 +891,8 @@ class ServiceNowClient:
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(file_name, 'File Name', str, 'String')
+        _require_str('Table', table)
+        _require_str('File Name', file_name)
 
         # Calling search method to search for matching incidents
         incident_list = self.search(table, search_list, custom, 'number,sys_id')
@@ -519,30 +904,37 @@ class ServiceNowClient:
             else:
                 return False
 
-        # Output dictionary
-        result = {}
+        # Everything but the sys_id is invariant across the fan-out
+        upload_url = self.instance + '/api/now/attachment/file'
+        base_name = ntpath.basename(file_name)
 
-        for item in incident_list:
+        # Passing the open handle streams the upload instead of holding
+        # the whole file in memory; Content-Length lets the server
+        # preallocate rather than fall back to chunked encoding
+        headers = {'Content-Type': '*/*',
+                   'Accept': 'application/json',
+                   'Content-Length': str(os.path.getsize(file_name))
+                   }
 
+        def _do(item):
             # Set the request parameters
-            self.url = self.instance + '/api/now/attachment/file?table_name=' + str(table) + '&table_sys_id=' + str(
-                item['sys_id']) + '&file_name=' + ntpath.basename(file_name)
-
-            data = open(file_name, 'rb').read()
-            headers = {'Content-Type': '*/*', 'Accept': 'application/json'}
+            url = (upload_url + '?table_name=' + table + '&table_sys_id='
+                   + item['sys_id'] + '&file_name=' + base_name)
 
-            response = requests.post(url=self.url,
-                                     auth=(self.username, self.password),
-                                     headers=headers, data=data)
+            with open(file_name, 'rb') as fh:
+                if self.http2:
+                    # httpx takes raw request bodies through content=
+                    response = self.session.post(url=url, headers=headers, content=fh)
+                else:
+                    response = self.session.post(url=url, headers=headers, data=fh)
 
-            if self.response.status_code > 299:
-                result[str(item['number'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                    self.response.json()['error'])
-            else:
-                result[str(item['number'])] = 'true'
+            if response.status_code > 299:
+                return item['number'], 'Error Code ' + str(response.status_code) + ', ' + str(
+                    _parse(response)['error'])
+            return item['number'], 'true'
 
         # Return result
-        return result
+        return dict(self._parallel_map(_do, incident_list))
 
     def delete_file(self, table, search_list, file_name, custom):
         """
@@ -559,8 +951,8 @@ class ServiceNowClient:
         """
 
         # Validation
-        self.__validate_format(table, 'Table', str, 'String')
-        self.__validate_format(file_name, 'File Name', str, 'String')
+        _require_str('Table', table)
+        _require_str('File Name', file_name)
 
         # Calling search method to search for matching incidents
         incident_list = self.search(table, search_list, custom, 'number,sys_id')
@@ -572,63 +964,44 @@ class ServiceNowClient:
             else:
                 return False
 
-        file_found_all = False
-
-        # Output dictionary
-        result = {}
-
-        # Checking incident for attachments
-        for item in incident_list:
-            # Set the request parameters
-            self.url = (self.instance
-                        + '/api/now/attachment?sysparm_limit=50&sysparm_query=sysparm_query=active=true^table_sys_id='
-                        + item['sys_id'])
-
-            self.response = requests.get(url=self.url,
-                                         auth=(self.username, self.password),
-                                         headers=self.headers,
-                                         )
-
-            # Check for HTTP codes other than 200
-            if self.response.status_code > 299:
-                result[str(item['number'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                    self.response.json()['error'])
-            else:
-                result[str(item['number'])] = 'true'
+        # All attachment listings collapse into one round trip; only the
+        # deletes fan out
+        attachments_by_sys_id = self._list_attachments(incident_list)
 
-            # Decode the JSON response
-            attachment_data = self.response.json()
+        def _do(item):
+            attachments = attachments_by_sys_id.get(item['sys_id'])
 
             # Terminate operation if no incidents are found
-            if not attachment_data['result']:
-                result[str(item['number'])] = 'false'
-                continue
-            else:
-                result[str(item['number'])] = 'true'
+            if not attachments:
+                return item['number'], 'false', False
 
             # Delete the specified types of file from the web location received in JSON response
+            value = 'true'
             file_found = False
-            for item_attach in attachment_data['result']:
+            for item_attach in attachments:
                 if str(item_attach['file_name']) == file_name:
                     file_found = True
-                    file_found_all = True
 
-                    self.url = self.instance + '/api/now/attachment/' + item_attach['sys_id']
+                    url = self.instance + '/api/now/attachment/' + item_attach['sys_id']
 
-                    self.response = requests.delete(url=self.url,
-                                                    auth=(self.username, self.password),
-                                                    headers=self.headers,
-                                                    )
+                    response = self.session.delete(url=url)
 
                     # Check for HTTP codes other than 204
-                    if self.response.status_code > 299:
-                        result[str(item['number'])] = 'Error Code ' + str(self.response.status_code) + ', ' + str(
-                            self.response.json()['error'])
-                    else:
-                        result[str(item['number'])] = 'true'
+                    if response.status_code > 299:
+                        value = 'Error Code ' + str(response.status_code) + ', ' + str(
+                            _parse(response)['error'])
 
             if not file_found:
-                result[str(item['number'])] = 'false'
+                value = 'false'
+
+            return item['number'], value, file_found
+
+        # Output dictionary
+        result = {}
+        file_found_all = False
+        for number, value, found in self._parallel_map(_do, incident_list):
+            result[number] = value
+            file_found_all = file_found_all or found
 
         if file_found_all:
             return result
@@ -654,46 +1027,40 @@ class ServiceNowClient:
         Output : returns email content
         """
 
-        self.__validate_format(to, 'Mandatory parameter "to"', str, 'String')
-        self.__validate_format(subject, 'Subject', str, 'String')
-        self.__validate_format(message, 'Message', str, 'String')
+        _require_str('Mandatory parameter "to"', to)
+        _require_str('Subject', subject)
+        _require_str('Message', message)
 
         if cc:
-            self.__validate_format(cc, 'CC', str, 'String')
+            _require_str('CC', cc)
 
         if bcc:
-            self.__validate_format(bcc, 'BCC', str, 'String')
+            _require_str('BCC', bcc)
 
         if table:
-            self.__validate_format(table, 'Table', str, 'String')
+            _require_str('Table', table)
 
         if sys_id:
-            self.__validate_format(sys_id, 'Sys_id', str, 'String')
+            _require_str('Sys_id', sys_id)
 
         # Set the request parameters
-        self.url = self.instance + '/api/now/v1/email'
-        self.data = ('{\"to\": [\"' + str(to)
-                     + '\"], \"cc\": [\"' + str(cc)
-                     + '\"], \"bcc\": [\"' + str(bcc)
-                     + '\"], \"subject\": \"' + str(subject)
-                     + '\", \"text\": \"' + str(message)
-                     + '\", \"table_name\": \"' + str(table)
-                     + '\", \"table_record_id\": \"' + str(sys_id)
-                     + '\"}'
-                     )
-        self.response = requests.post(url=self.url,
-                                      auth=(self.username,
-                                            self.password),
-                                      headers=self.headers,
-                                      data=self.data
-                                      )
-
-        if self.response.status_code > 299:
+        url = self.instance + '/api/now/v1/email'
+        payload = {'to': [str(to)],
+                   'cc': [str(cc)],
+                   'bcc': [str(bcc)],
+                   'subject': str(subject),
+                   'text': str(message),
+                   'table_name': str(table),
+                   'table_record_id': str(sys_id)
+                   }
+        response = self.session.post(url=url, json=payload)
+
+        if response.status_code > 299:
             raise ResponseError(
-                'Error code = ' + str(self.response.status_code) + ' , Error details = ' + str(self.response.json()))
+                'Error code = ' + str(response.status_code) + ' , Error details = ' + str(_parse(response)))
 
         # Decode the JSON response into a dictionary and use the data
-        data = self.response.json()
+        data = _parse(response)
         return data['result']
 
     def read_email(self, sys_id):
@@ -706,33 +1073,99 @@ class ServiceNowClient:
         Output : returns email data
         """
 
-        self.__validate_format(sys_id, 'sys_id', str, 'String')
+        _require_str('sys_id', sys_id)
+
+        # Emails are immutable once sent, so repeated reads of the same
+        # sys_id are served from the cache without a round trip; hits are
+        # re-inserted so eviction discards the least recently read email
+        if sys_id in self._email_cache:
+            self._email_cache[sys_id] = self._email_cache.pop(sys_id)
+            return self._email_cache[sys_id]
 
         # Set the request parameters
-        self.url = self.instance + '/api/now/v1/email/' + str(sys_id)
+        url = self.instance + '/api/now/v1/email/' + str(sys_id)
 
-        self.response = requests.get(url=self.url,
-                                     auth=(self.username, self.password),
-                                     headers=self.headers
-                                     )
+        response = self.session.get(url=url)
 
-        if self.response.status_code > 299:
+        if response.status_code > 299:
             raise ResponseError(
-                'Error code = ' + str(self.response.status_code) + ' , Error details = ' + str(self.response.json()))
+                'Error code = ' + str(response.status_code) + ' , Error details = ' + str(_parse(response)))
 
         # Decode the JSON response into a dictionary and use the data
-        data = self.response.json()
+        data = _parse(response)
 
+        _bounded_put(self._email_cache, sys_id, data['result'])
         return data['result']
 
-    @staticmethod
-    def __validate_format(var, var_label, instance_type, instance_type_label):
-        if not isinstance(var, instance_type):
-            raise InvalidFormat(var_label + ' format incorrect. ' + instance_type_label + 'expected.')
+    def cache_clear(self):
+        """
+        Drop every cached search and read_email result
+
+        :param self: self object
+
+        Output : none
+        """
+
+        self._email_cache.clear()
+        self._get_cache.clear()
+
+    def _batch(self, rest_requests, timeout=10):
+        """
+        Execute a list of sub-requests through the ServiceNow Batch API
+
+        :param self: self object
+        :param rest_requests: sub-requests as expected by /api/now/v1/batch (list of dictionaries)
+        :param timeout: set timeout interval, default is 10
+
+        Output : returns the serviced sub-request results of every batch
+        """
+
+        serviced = []
+
+        # Chunking keeps each batch well within instance size limits
+        for start in range(0, len(rest_requests), 100):
+            data = {'batch_request_id': str(uuid.uuid4()),
+                    'rest_requests': rest_requests[start:start + 100]
+                    }
+            response = self.session.post(url=self.instance + '/api/now/v1/batch',
+                                         json=data,
+                                         timeout=timeout
+                                         )
+
+            if response.status_code > 299:
+                raise ResponseError(
+                    'Error code = ' + str(response.status_code) + ' , Error details = ' + str(_parse(response)))
+
+            serviced.extend(_parse(response)['serviced_requests'])
+
+        return serviced
 
     @staticmethod
-    def __define_table(table, custom):
-        if custom:
-            return table
-        else:
-            return f'/api/now/table/{table}'
+    def __decode_batch_body(serviced):
+        # Batch sub-request bodies come back base64 encoded
+        try:
+            return _json_loads(base64.b64decode(serviced.get('body', '')).decode())
+        except (ValueError, UnicodeDecodeError):
+            return serviced.get('body', '')
+
+    def _parallel_map(self, fn, items):
+        """
+        Run fn over items with a bounded thread pool and return the results
+
+        :param self: self object
+        :param fn: callable applied to each item
+        :param items: iterable of items to process
+
+        Output : returns list with the result of fn for each item
+        """
+
+        futures = [self._get_executor().submit(fn, item) for item in items]
+        return [future.result() for future in as_completed(futures)]
+
+    def _get_executor(self):
+        # The executor lives as long as the client, like the session, so
+        # repeated bulk calls don't pay thread startup each time
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self._executor
+